@@ -0,0 +1,39 @@
+# Production profile: N uvicorn workers behind gunicorn.
+#
+#   cd backend && gunicorn -c gunicorn.conf.py server:app
+#
+# Each worker is a separate process with its own Mongo client, JWT cache and
+# write buffer (shared-nothing). Point load balancer readiness probes at
+# /api/health/ready and liveness probes at /api/health/live.
+import multiprocessing
+import os
+
+# One async worker per core; the LLM calls are I/O bound
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.environ.get('BIND', '0.0.0.0:8001')
+
+# Split the Mongo connection budget across workers. Exported before the
+# workers start, so server.py reads it at import time.
+MONGO_MAX_CONNECTIONS = int(os.environ.get('MONGO_MAX_CONNECTIONS', '400'))
+os.environ.setdefault('MONGO_MAX_POOL_SIZE', str(max(1, MONGO_MAX_CONNECTIONS // workers)))
+os.environ.setdefault('MONGO_MIN_POOL_SIZE', str(min(5, int(os.environ['MONGO_MAX_POOL_SIZE']))))
+
+# The app must be imported after fork: a Motor client can't be shared
+# between processes
+preload_app = False
+
+# LLM calls can take tens of seconds. On SIGTERM a worker reports
+# "draining" on /api/health/ready, keeps serving for
+# DRAIN_SIGNAL_DELAY_SECONDS, then stops accepting connections and finishes
+# in-flight requests; the shutdown hook waits DRAIN_TIMEOUT_SECONDS for
+# background LLM calls.
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get('DRAIN_TIMEOUT_SECONDS', '30'))
+DRAIN_SIGNAL_DELAY_SECONDS = float(os.environ.get('DRAIN_SIGNAL_DELAY_SECONDS', '5'))
+timeout = 120
+graceful_timeout = DRAIN_SIGNAL_DELAY_SECONDS + DRAIN_TIMEOUT_SECONDS + 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
@@ -1,14 +1,35 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import bson
+import zstandard
+try:
+    import brotli
+except ImportError:  # optional, enables br response compression
+    brotli = None
+import io
 import os
+import gzip
+import json
+import re
+import zlib
+import fcntl
+import signal
+import threading
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
+import time
+import hashlib
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
@@ -18,15 +39,40 @@ from emergentintegrations.payments.stripe.checkout import StripeCheckout, Checko
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (one client per worker process; gunicorn.conf.py sizes
+# MONGO_MAX_POOL_SIZE so all workers together stay within the server limit)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+client = AsyncIOMotorClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET', 'smart_cooking_secret')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', '10000'))
+# Each worker has its own revocation set, synced from db.revoked_tokens
+JWT_REVOCATION_SYNC_SECONDS = int(os.environ.get('JWT_REVOCATION_SYNC_SECONDS', '15'))
+
+def _parse_jwt_keys(raw: str) -> dict:
+    # Format: "kid1:secret1,kid2:secret2"
+    keys = {}
+    for item in raw.split(','):
+        if ':' in item:
+            kid, secret = item.split(':', 1)
+            keys[kid.strip()] = secret.strip()
+    return keys
+
+# Signing keys by key id. New tokens use JWT_ACTIVE_KID, the other kids stay
+# valid for verification until they are removed from JWT_KEYS.
+JWT_KEYS = _parse_jwt_keys(os.environ.get('JWT_KEYS', '')) or {"default": JWT_SECRET}
+JWT_ACTIVE_KID = os.environ.get('JWT_ACTIVE_KID', next(iter(JWT_KEYS)))
+if JWT_ACTIVE_KID not in JWT_KEYS:
+    raise RuntimeError(f"JWT_ACTIVE_KID '{JWT_ACTIVE_KID}' non presente in JWT_KEYS")
+# Key that verifies tokens issued before rotation (they carry no kid). Once it
+# is removed from JWT_KEYS (or JWT_LEGACY_KID is empty) they are rejected.
+JWT_LEGACY_KID = os.environ.get('JWT_LEGACY_KID', 'default')
 
 # Stripe Config
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
@@ -38,7 +84,77 @@ EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 FREE_RECIPES_LIMIT = 50
 UNLIMITED_PRICE = 2.99
 
+# Off-peak precomputation of popular ingredient combinations
+PRECOMPUTE_LLM_BUDGET = int(os.environ.get('PRECOMPUTE_LLM_BUDGET', '30'))  # max LLM calls per run, 0 disables
+PRECOMPUTE_TOP_N = int(os.environ.get('PRECOMPUTE_TOP_N', '20'))
+PRECOMPUTE_VARIANTS = int(os.environ.get('PRECOMPUTE_VARIANTS', '3'))
+PRECOMPUTE_MIN_REQUESTS = int(os.environ.get('PRECOMPUTE_MIN_REQUESTS', '5'))
+PRECOMPUTE_WINDOW_DAYS = int(os.environ.get('PRECOMPUTE_WINDOW_DAYS', '14'))
+PRECOMPUTE_MAX_AGE_DAYS = int(os.environ.get('PRECOMPUTE_MAX_AGE_DAYS', '7'))
+
+# Window for daily background jobs (UTC hours)
+OFFPEAK_START_HOUR = int(os.environ.get('OFFPEAK_START_HOUR', '2'))
+OFFPEAK_END_HOUR = int(os.environ.get('OFFPEAK_END_HOUR', '5'))
+OFFPEAK_CHECK_INTERVAL_SECONDS = 600
+
+USER_STATS_TOP_INGREDIENTS = 5
+# The backfill only rewrites counters of users idle for this long
+USER_STATS_REPAIR_QUIET_SECONDS = int(os.environ.get('USER_STATS_REPAIR_QUIET_SECONDS', '300'))
+# Backfill passes repeat at this interval until no drifted user is left
+USER_STATS_BACKFILL_INTERVAL_SECONDS = int(os.environ.get('USER_STATS_BACKFILL_INTERVAL_SECONDS', '3600'))
+
+# Retention: old, unsaved and unshared recipes move to the archive tier
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '90'))  # 0 disables archival
+RETENTION_TARGET = os.environ.get('RETENTION_TARGET', 'mongo')  # mongo (recipe_archive) or file
+RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', str(ROOT_DIR / 'archive'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))
+RETENTION_ZLIB_LEVEL = 6
+RETENTION_ZSTD_LEVEL = 10
+if RETENTION_TARGET not in ("mongo", "file"):
+    raise RuntimeError(f"RETENTION_TARGET non valido: '{RETENTION_TARGET}'")
+
+# Response compression for recipe payloads
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))  # bytes
+COMPRESSED_PATH_PREFIXES = ("/api/recipes", "/api/users")
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_ZSTD_LEVEL = 6
+
+# Write-behind batching of generate_recipe side effects
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+WRITE_BEHIND_DURABILITY = os.environ.get('WRITE_BEHIND_DURABILITY', 'flush')  # flush or journal
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', '100'))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL_MS', '200'))
+WRITE_BEHIND_JOURNAL_DIR = os.environ.get('WRITE_BEHIND_JOURNAL_DIR', str(ROOT_DIR / 'journal'))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', '5'))
+WRITE_BEHIND_MAX_BACKOFF_SECONDS = 30
+WRITE_BEHIND_DEAD_LETTER_LIMIT = 1000
+if WRITE_BEHIND_DURABILITY not in ("flush", "journal"):
+    raise RuntimeError(f"WRITE_BEHIND_DURABILITY non valido: '{WRITE_BEHIND_DURABILITY}'")
+
+# LLM provider circuit breaker
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '45'))
+LLM_BREAKER_WINDOW = int(os.environ.get('LLM_BREAKER_WINDOW', '20'))  # last N calls
+LLM_BREAKER_MIN_CALLS = int(os.environ.get('LLM_BREAKER_MIN_CALLS', '5'))
+LLM_BREAKER_FAILURE_RATE = float(os.environ.get('LLM_BREAKER_FAILURE_RATE', '0.5'))
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('LLM_BREAKER_SLOW_CALL_SECONDS', '20'))
+LLM_BREAKER_SLOW_CALL_RATE = float(os.environ.get('LLM_BREAKER_SLOW_CALL_RATE', '0.8'))
+LLM_BREAKER_OPEN_SECONDS = float(os.environ.get('LLM_BREAKER_OPEN_SECONDS', '30'))
+LLM_BREAKER_HALF_OPEN_PROBES = int(os.environ.get('LLM_BREAKER_HALF_OPEN_PROBES', '1'))
+FALLBACK_CANDIDATES = 50
+
+# Fields dropped from list endpoints in compact mode unless requested via ?include=
+COMPACT_OMITTED_FIELDS = ("instructions", "tips", "substitutions")
+
 app = FastAPI()
+
+# Worker lifecycle, reported by the readiness check
+app_state = {"ready": False, "draining": False, "llm_inflight": 0, "warm_up_error": None}
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get('DRAIN_TIMEOUT_SECONDS', '30'))
+# Delay between SIGTERM and closing the listener, so load balancers see the
+# failing readiness probe before connections are refused
+DRAIN_SIGNAL_DELAY_SECONDS = float(os.environ.get('DRAIN_SIGNAL_DELAY_SECONDS', '5'))
+WARM_UP_RETRY_SECONDS = 5
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer(auto_error=False)
 
@@ -104,6 +220,47 @@ class SavedRecipeResponse(BaseModel):
     substitutions: Optional[List[str]] = None
     saved_at: str
 
+class RecipeListItem(BaseModel):
+    id: str
+    title: str
+    description: str
+    ingredients: List[str]
+    instructions: Optional[List[str]] = None
+    prep_time: str
+    cook_time: str
+    servings: int
+    category: str
+    tips: Optional[str] = None
+    substitutions: Optional[List[str]] = None
+    created_at: str
+    user_id: str
+
+class SavedRecipeListItem(BaseModel):
+    id: str
+    recipe_id: str
+    title: str
+    description: str
+    ingredients: List[str]
+    instructions: Optional[List[str]] = None
+    prep_time: str
+    cook_time: str
+    servings: int
+    category: str
+    tips: Optional[str] = None
+    substitutions: Optional[List[str]] = None
+    saved_at: str
+
+class IngredientCount(BaseModel):
+    name: str
+    count: int
+
+class UserStatsResponse(BaseModel):
+    recipes_generated: int
+    recipes_by_category: Dict[str, int]
+    favourite_ingredients: List[IngredientCount]
+    saved_recipes: int
+    saved_by_category: Dict[str, int]
+
 class CheckoutRequest(BaseModel):
     origin_url: str
 
@@ -121,22 +278,135 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+class TokenCache:
+    """Bounded LRU of verified token digests -> (user_id, exp, iat)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, digest: str) -> Optional[tuple]:
+        entry = self._entries.get(digest)
+        if entry is not None:
+            self._entries.move_to_end(digest)
+        return entry
+
+    def put(self, digest: str, entry: tuple):
+        self._entries[digest] = entry
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, digest: str):
+        self._entries.pop(digest, None)
+
+token_cache = TokenCache(JWT_CACHE_SIZE)
+# Digests of tokens revoked on logout -> token expiry (unix time), loaded from
+# db.revoked_tokens; entries are pruned once the token would have expired
+revoked_token_digests = {}
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
 def create_token(user_id: str) -> str:
     payload = {
         "user_id": user_id,
+        "iat": time.time(),
         "exp": datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return jwt.encode(payload, JWT_KEYS[JWT_ACTIVE_KID], algorithm=JWT_ALGORITHM, headers={"kid": JWT_ACTIVE_KID})
+
+def decode_token(token: str) -> tuple:
+    """Return (user_id, iat) for a valid token. Repeat tokens are served from
+    the LRU until they expire, skipping signature verification."""
+    digest = token_digest(token)
+    if digest in revoked_token_digests:
+        raise jwt.InvalidTokenError("Token revocato")
+
+    cached = token_cache.get(digest)
+    if cached is not None:
+        user_id, exp, iat = cached
+        if exp <= time.time():
+            token_cache.discard(digest)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return user_id, iat
+
+    # Tokens issued before key rotation carry no kid
+    kid = jwt.get_unverified_header(token).get("kid") or JWT_LEGACY_KID
+    key = JWT_KEYS.get(kid) if kid else None
+    if key is None:
+        raise jwt.InvalidTokenError("Chiave sconosciuta")
+
+    payload = jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+    user_id = payload.get("user_id")
+    iat = payload.get("iat", 0)
+    if payload.get("exp") is not None:
+        token_cache.put(digest, (user_id, payload["exp"], iat))
+    return user_id, iat
+
+def is_token_revoked_for_user(user: dict, iat: float) -> bool:
+    # Set by logout-all (and any future password change): older tokens are rejected
+    return iat < user.get("tokens_valid_after", 0)
+
+async def revoke_token(token: str):
+    digest = token_digest(token)
+    cached = token_cache.get(digest)
+    if cached is not None:
+        expires_at = datetime.fromtimestamp(cached[1], timezone.utc)
+    else:
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+    revoked_token_digests[digest] = expires_at.timestamp()
+    token_cache.discard(digest)
+    # The TTL index drops the entry once the token would have expired anyway
+    await db.revoked_tokens.update_one(
+        {"digest": digest},
+        {"$set": {"digest": digest, "expires_at": expires_at, "revoked_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def revoke_user_tokens(user_id: str):
+    await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"tokens_valid_after": time.time()}}
+    )
+
+async def load_revoked_tokens(since: Optional[datetime] = None):
+    query = {"expires_at": {"$gt": datetime.now(timezone.utc)}}
+    if since:
+        query["revoked_at"] = {"$gte": since}
+    async for doc in db.revoked_tokens.find(query, {"_id": 0, "digest": 1, "expires_at": 1}):
+        digest = doc["digest"]
+        # Mongo returns naive UTC datetimes
+        revoked_token_digests[digest] = doc["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        token_cache.discard(digest)
+
+def prune_revoked_tokens():
+    # Expired tokens fail verification anyway; keeps the set bounded like the TTL index
+    now = time.time()
+    for digest in [d for d, exp in revoked_token_digests.items() if exp <= now]:
+        del revoked_token_digests[digest]
+
+async def sync_revoked_tokens():
+    # Picks up logouts handled by other workers; the overlap covers clock skew
+    while True:
+        since = datetime.now(timezone.utc) - timedelta(seconds=JWT_REVOCATION_SYNC_SECONDS * 2)
+        await asyncio.sleep(JWT_REVOCATION_SYNC_SECONDS)
+        prune_revoked_tokens()
+        try:
+            await load_revoked_tokens(since)
+        except Exception as e:
+            logger.error(f"Revocation sync error: {e}")
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if not credentials:
         raise HTTPException(status_code=401, detail="Token mancante")
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
+        user_id, iat = decode_token(credentials.credentials)
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if not user:
             raise HTTPException(status_code=401, detail="Utente non trovato")
+        if is_token_revoked_for_user(user, iat):
+            raise HTTPException(status_code=401, detail="Token revocato")
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token scaduto")
@@ -147,9 +417,10 @@ async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(
     if not credentials:
         return None
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
+        user_id, iat = decode_token(credentials.credentials)
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if user and is_token_revoked_for_user(user, iat):
+            return None
         return user
     except:
         return None
@@ -238,37 +509,147 @@ async def get_me(user: dict = Depends(get_current_user)):
         created_at=user["created_at"]
     )
 
+@api_router.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security), user: dict = Depends(get_current_user)):
+    await revoke_token(credentials.credentials)
+    return {"message": "Logout effettuato"}
+
+@api_router.post("/auth/logout-all")
+async def logout_all(user: dict = Depends(get_current_user)):
+    await revoke_user_tokens(user["id"])
+    return {"message": "Logout effettuato da tutti i dispositivi"}
+
+# ==================== LLM CIRCUIT BREAKER ====================
+
+class LLMUnavailableError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Circuit breaker for the LLM provider.
+
+    Closed: calls go through and their outcome lands in a rolling window.
+    The circuit opens once the window holds min_calls outcomes and either
+    the failure rate or the slow-call rate reaches its threshold. Open:
+    calls are rejected at once for open_seconds. Half-open: up to
+    half_open_probes calls go through; a success closes the circuit and a
+    failure opens it again.
+
+    allow() returns a ticket (None when rejected) to pass back to record()
+    or release(). Tickets from before the last transition are ignored, so a
+    slow call started while closed can't decide a half-open verdict or free
+    a probe slot it never took.
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, slow_call_seconds: float,
+                 slow_call_rate: float, open_seconds: float, half_open_probes: int):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probes_inflight = 0
+        self._generation = 0  # bumped on every transition
+        self.transitions = {}
+        self.last_transition_at = None
+        self.rejected_calls = 0
+
+    def _transition(self, state: str):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.last_transition_at = datetime.now(timezone.utc).isoformat()
+        logger.warning(f"LLM circuit breaker: {key}")
+        self.state = state
+        self._generation += 1
+        self._probes_inflight = 0
+        if state == "open":
+            self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def allow(self) -> Optional[tuple]:
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition("half_open")
+        if self.state == "open" or (self.state == "half_open" and self._probes_inflight >= self.half_open_probes):
+            self.rejected_calls += 1
+            return None
+        if self.state == "half_open":
+            self._probes_inflight += 1
+        return (self._generation, self.state == "half_open")
+
+    def _is_current_probe(self, ticket: tuple) -> bool:
+        return self.state == "half_open" and ticket == (self._generation, True)
+
+    def release(self, ticket: tuple):
+        # Call abandoned (e.g. client disconnected): no verdict on the provider
+        if self._is_current_probe(ticket):
+            self._probes_inflight -= 1
+
+    def record(self, ticket: tuple, success: bool, elapsed: float):
+        slow = elapsed >= self.slow_call_seconds
+        if self._is_current_probe(ticket):
+            self._probes_inflight -= 1
+            self._transition("closed" if success and not slow else "open")
+            return
+        if self.state != "closed" or ticket[0] != self._generation:
+            return
+        self._outcomes.append((not success, slow))
+        if len(self._outcomes) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if failures / len(self._outcomes) >= self.failure_rate or slow_calls / len(self._outcomes) >= self.slow_call_rate:
+            self._transition("open")
+
+    def metrics(self) -> dict:
+        total = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": total,
+            "window_failure_rate": round(sum(1 for f, _ in self._outcomes if f) / total, 3) if total else 0.0,
+            "window_slow_rate": round(sum(1 for _, s in self._outcomes if s) / total, 3) if total else 0.0,
+            "rejected_calls": self.rejected_calls,
+            "transitions": self.transitions,
+            "last_transition_at": self.last_transition_at
+        }
+
+llm_breaker = CircuitBreaker(
+    window=LLM_BREAKER_WINDOW,
+    min_calls=LLM_BREAKER_MIN_CALLS,
+    failure_rate=LLM_BREAKER_FAILURE_RATE,
+    slow_call_seconds=LLM_BREAKER_SLOW_CALL_SECONDS,
+    slow_call_rate=LLM_BREAKER_SLOW_CALL_RATE,
+    open_seconds=LLM_BREAKER_OPEN_SECONDS,
+    half_open_probes=LLM_BREAKER_HALF_OPEN_PROBES
+)
+
 # ==================== RECIPE GENERATION ====================
 
-@api_router.post("/recipes/generate", response_model=RecipeResponse)
-async def generate_recipe(data: RecipeGenerateRequest, user: dict = Depends(get_current_user)):
-    # Check usage limits
-    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    if user.get("month_reset") != current_month:
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$set": {"recipes_generated_this_month": 0, "month_reset": current_month}}
-        )
-        user["recipes_generated_this_month"] = 0
-    
-    if user.get("plan") != "unlimited" and user.get("recipes_generated_this_month", 0) >= FREE_RECIPES_LIMIT:
-        raise HTTPException(
-            status_code=403, 
-            detail=f"Hai raggiunto il limite di {FREE_RECIPES_LIMIT} ricette mensili. Passa a Unlimited per ricette illimitate!"
-        )
-    
-    # Generate recipe with AI
-    category_prompts = {
-        "salato": "un piatto salato italiano",
-        "dolce": "un dolce o dessert italiano",
-        "veloce": "un piatto veloce pronto in massimo 20 minuti"
-    }
-    
-    category_desc = category_prompts.get(data.category, "un piatto italiano")
+CATEGORY_PROMPTS = {
+    "salato": "un piatto salato italiano",
+    "dolce": "un dolce o dessert italiano",
+    "veloce": "un piatto veloce pronto in massimo 20 minuti"
+}
+
+# Recipe content as produced by the LLM, without id/user/timestamps
+RECIPE_CONTENT_FIELDS = (
+    "title", "description", "ingredients", "instructions", "prep_time",
+    "cook_time", "servings", "category", "tips", "substitutions"
+)
+
+def recipe_signature(ingredients: List[str], category: str, servings: int) -> str:
+    # Normalized input key: order, case and duplicates don't matter
+    normalized = sorted({i.strip().lower() for i in ingredients if i.strip()})
+    return f"{category}|{servings}|{','.join(normalized)}"
+
+def build_recipe_prompt(ingredients: List[str], category: str, servings: int) -> str:
+    category_desc = CATEGORY_PROMPTS.get(category, "un piatto italiano")
     
-    prompt = f"""Sei uno chef italiano esperto. Crea una ricetta per {category_desc} usando questi ingredienti: {', '.join(data.ingredients)}.
+    return f"""Sei uno chef italiano esperto. Crea una ricetta per {category_desc} usando questi ingredienti: {', '.join(ingredients)}.
     
-La ricetta deve essere per {data.servings} persone.
+La ricetta deve essere per {servings} persone.
 
 Rispondi SOLO in formato JSON valido con questa struttura esatta:
 {{
@@ -284,72 +665,626 @@ Rispondi SOLO in formato JSON valido con questa struttura esatta:
 
 NON aggiungere testo prima o dopo il JSON."""
 
+async def generate_recipe_fields(ingredients: List[str], category: str, servings: int) -> dict:
+    """Call the LLM and return the recipe content fields (no id/user/timestamps)."""
+    chat = LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=f"recipe-{uuid.uuid4()}",
+        system_message="Sei uno chef italiano professionista. Rispondi sempre in italiano e solo in formato JSON valido."
+    ).with_model("gemini", "gemini-3-flash-preview")
+    
+    ticket = llm_breaker.allow()
+    if ticket is None:
+        raise LLMUnavailableError("Circuit breaker aperto")
+    
+    app_state["llm_inflight"] += 1
+    start = time.monotonic()
+    try:
+        response = await asyncio.wait_for(
+            chat.send_message(UserMessage(text=build_recipe_prompt(ingredients, category, servings))),
+            timeout=LLM_TIMEOUT_SECONDS
+        )
+    except asyncio.CancelledError:
+        llm_breaker.release(ticket)
+        raise
+    except Exception:
+        llm_breaker.record(ticket, False, time.monotonic() - start)
+        raise
+    finally:
+        app_state["llm_inflight"] -= 1
+    # Unparseable output is a content problem, not an outage
+    llm_breaker.record(ticket, True, time.monotonic() - start)
+    
+    # Clean response - remove markdown code blocks if present
+    clean_response = response.strip()
+    if clean_response.startswith("```json"):
+        clean_response = clean_response[7:]
+    if clean_response.startswith("```"):
+        clean_response = clean_response[3:]
+    if clean_response.endswith("```"):
+        clean_response = clean_response[:-3]
+    clean_response = clean_response.strip()
+    
     try:
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"recipe-{uuid.uuid4()}",
-            system_message="Sei uno chef italiano professionista. Rispondi sempre in italiano e solo in formato JSON valido."
-        ).with_model("gemini", "gemini-3-flash-preview")
-        
-        response = await chat.send_message(UserMessage(text=prompt))
-        
-        # Parse JSON response
-        import json
-        # Clean response - remove markdown code blocks if present
-        clean_response = response.strip()
-        if clean_response.startswith("```json"):
-            clean_response = clean_response[7:]
-        if clean_response.startswith("```"):
-            clean_response = clean_response[3:]
-        if clean_response.endswith("```"):
-            clean_response = clean_response[:-3]
-        clean_response = clean_response.strip()
-        
         recipe_data = json.loads(clean_response)
-        
-        recipe_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc).isoformat()
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parse error: {e}, response: {response[:500]}")
+        raise
+    
+    return {
+        "title": recipe_data.get("title", "Ricetta Senza Nome"),
+        "description": recipe_data.get("description", ""),
+        "ingredients": recipe_data.get("ingredients", ingredients),
+        "instructions": recipe_data.get("instructions", []),
+        "prep_time": recipe_data.get("prep_time", "N/A"),
+        "cook_time": recipe_data.get("cook_time", "N/A"),
+        "servings": servings,
+        "category": category,
+        "tips": recipe_data.get("tips"),
+        "substitutions": recipe_data.get("substitutions")
+    }
+
+@api_router.post("/recipes/generate", response_model=RecipeResponse)
+async def generate_recipe(data: RecipeGenerateRequest, response: Response, user: dict = Depends(get_current_user)):
+    # Check usage limits
+    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
+    if user.get("month_reset") != current_month:
+        await db.users.update_one(
+            {"id": user["id"]},
+            {"$set": {"recipes_generated_this_month": 0, "month_reset": current_month}}
+        )
+        user["recipes_generated_this_month"] = 0
+    
+    if user.get("plan") != "unlimited" and user.get("recipes_generated_this_month", 0) >= FREE_RECIPES_LIMIT:
+        raise HTTPException(
+            status_code=403, 
+            detail=f"Hai raggiunto il limite di {FREE_RECIPES_LIMIT} ricette mensili. Passa a Unlimited per ricette illimitate!"
+        )
+    
+    signature = recipe_signature(data.ingredients, data.category, data.servings)
+    degraded = False
+    
+    try:
+        # Popular combinations are served from the off-peak precomputed pool
+        fields = await take_precomputed_recipe(signature)
+        if fields is None:
+            try:
+                fields = await generate_recipe_fields(data.ingredients, data.category, data.servings)
+            except json.JSONDecodeError:
+                raise
+            except Exception as e:
+                # Upstream down, slow or circuit open: serve the closest known recipe
+                logger.warning(f"LLM unavailable, degraded mode: {e!r}")
+                fields = await find_fallback_recipe(data.ingredients, data.category)
+                if fields is None:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Il nostro chef AI è momentaneamente non disponibile. Riprova tra qualche minuto."
+                    )
+                response.headers["X-Recipe-Degraded"] = "true"
+                degraded = True
         
         recipe = {
-            "id": recipe_id,
-            "title": recipe_data.get("title", "Ricetta Senza Nome"),
-            "description": recipe_data.get("description", ""),
-            "ingredients": recipe_data.get("ingredients", data.ingredients),
-            "instructions": recipe_data.get("instructions", []),
-            "prep_time": recipe_data.get("prep_time", "N/A"),
-            "cook_time": recipe_data.get("cook_time", "N/A"),
-            "servings": data.servings,
-            "category": data.category,
-            "tips": recipe_data.get("tips"),
-            "substitutions": recipe_data.get("substitutions"),
-            "created_at": now,
-            "user_id": user["id"]
+            "id": str(uuid.uuid4()),
+            **fields,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "user_id": user["id"],
+            "input_signature": signature,
+            "input_ingredients": data.ingredients
         }
         
-        # Save recipe to history
-        await db.recipes.insert_one(recipe)
-        
-        # Update user's recipe count
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$inc": {"recipes_generated_this_month": 1}}
-        )
+        if degraded:
+            # Not what was asked for: kept in history, but not charged against
+            # the monthly limit and left out of stats and precompute mining
+            recipe["degraded"] = True
+            await db.recipes.insert_one(recipe)
+        elif write_buffer:
+            # Insert and counters are batched with other requests
+            await write_buffer.add(recipe, recipe_stats_inc(data.category, data.ingredients))
+        else:
+            # Save recipe to history
+            await db.recipes.insert_one(recipe)
+            
+            # Update user's recipe count
+            await db.users.update_one(
+                {"id": user["id"]},
+                {"$inc": {"recipes_generated_this_month": 1}}
+            )
+            await record_recipe_stats(user["id"], data.category, data.ingredients)
         
         return RecipeResponse(**recipe)
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parse error: {e}, response: {response[:500]}")
+    except HTTPException:
+        raise
+    except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Errore nel generare la ricetta. Riprova.")
     except Exception as e:
         logger.error(f"Recipe generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nel generare la ricetta: {str(e)}")
 
+# ==================== PRECOMPUTED RECIPES ====================
+
+async def take_precomputed_recipe(signature: str) -> Optional[dict]:
+    # Least-served variant first, so repeated requests rotate through the pool
+    variant = await db.precomputed_recipes.find_one_and_update(
+        {"signature": signature},
+        {"$inc": {"served_count": 1}},
+        sort=[("served_count", 1)],
+        projection={"_id": 0, "recipe": 1}
+    )
+    return variant["recipe"] if variant else None
+
+async def find_fallback_recipe(ingredients: List[str], category: str) -> Optional[dict]:
+    """Closest existing recipe for degraded mode: same category, most
+    ingredients in common, from the precomputed pool and recent history."""
+    wanted = {stat_key(i) for i in ingredients if stat_key(i)}
+    variants = list({*ingredients, *(i.strip().lower() for i in ingredients)})
+    
+    candidates = []
+    async for doc in db.precomputed_recipes.find(
+        {"signature": {"$regex": f"^{re.escape(category)}\\|"}}, {"_id": 0, "signature": 1, "recipe": 1}
+    ).limit(FALLBACK_CANDIDATES):
+        candidates.append((doc["signature"].split("|", 2)[2].split(","), doc["recipe"]))
+    async for doc in db.recipes.find(
+        {"category": category, "input_ingredients": {"$in": variants}, "degraded": {"$ne": True}}, {"_id": 0}
+    ).sort("created_at", -1).limit(FALLBACK_CANDIDATES):
+        candidates.append((doc["input_ingredients"], doc))
+    
+    best, best_score = None, 0.0
+    for candidate_ingredients, recipe in candidates:
+        have = {stat_key(i) for i in candidate_ingredients if stat_key(i)}
+        score = len(wanted & have) / len(wanted | have) if wanted | have else 0.0
+        if score > best_score:
+            best, best_score = recipe, score
+    if best is None:
+        return None
+    return {field: best.get(field) for field in RECIPE_CONTENT_FIELDS}
+
+async def precompute_popular_recipes() -> int:
+    """Pre-generate variants for the most requested input signatures.
+    Returns the number of LLM calls made, never more than PRECOMPUTE_LLM_BUDGET."""
+    now = datetime.now(timezone.utc)
+    since = (now - timedelta(days=PRECOMPUTE_WINDOW_DAYS)).isoformat()
+    stale_before = (now - timedelta(days=PRECOMPUTE_MAX_AGE_DAYS)).isoformat()
+    
+    # Retire old variants so the pool keeps rotating day over day
+    await db.precomputed_recipes.delete_many({"generated_at": {"$lt": stale_before}})
+    
+    pipeline = [
+        # Fallback recipes carry the request's signature but another recipe's content
+        {"$match": {"input_signature": {"$exists": True}, "degraded": {"$ne": True}, "created_at": {"$gte": since}}},
+        {"$group": {
+            "_id": "$input_signature",
+            "count": {"$sum": 1},
+            "ingredients": {"$first": "$input_ingredients"},
+            "category": {"$first": "$category"},
+            "servings": {"$first": "$servings"}
+        }},
+        {"$match": {"count": {"$gte": PRECOMPUTE_MIN_REQUESTS}}},
+        {"$sort": {"count": -1}},
+        {"$limit": PRECOMPUTE_TOP_N}
+    ]
+    
+    calls = 0
+    async for combo in db.recipes.aggregate(pipeline):
+        existing = await db.precomputed_recipes.count_documents({"signature": combo["_id"]})
+        for _ in range(PRECOMPUTE_VARIANTS - existing):
+            if calls >= PRECOMPUTE_LLM_BUDGET or app_state["draining"]:
+                return calls
+            calls += 1
+            try:
+                fields = await generate_recipe_fields(combo["ingredients"], combo["category"], combo["servings"])
+            except Exception as e:
+                logger.error(f"Precompute error for {combo['_id']}: {e}")
+                continue
+            await db.precomputed_recipes.insert_one({
+                "id": str(uuid.uuid4()),
+                "signature": combo["_id"],
+                "recipe": fields,
+                "served_count": 0,
+                "generated_at": datetime.now(timezone.utc).isoformat()
+            })
+    return calls
+
+# ==================== WRITE-BEHIND BUFFER ====================
+
+class WriteBehindBuffer:
+    """Groups generate_recipe side effects into bulk writes.
+
+    Recipe inserts become one insert_many and the users/user_stats counters
+    are folded per user into bulk_write. The buffer is flushed when it holds
+    max_batch entries or every interval seconds. With durability "flush" the
+    caller waits for its recipe to be inserted; with "journal" the entry is
+    fsync'ed to a per-process journal file and the caller returns at once.
+
+    Each write is tracked on its own: when a bulk write partly fails only the
+    failed operations are retried, with exponential backoff, alongside new
+    entries (never blocking them). Connection errors don't count as attempts;
+    an operation rejected max_attempts times is moved to the dead-letter
+    list. Counters are only applied once their recipe is inserted.
+
+    Dead letters are never checkpointed: the journal keeps them, so the next
+    worker that adopts it retries them (and their recipes stay readable).
+    """
+
+    def __init__(self, max_batch: int, interval: float, durability: str, journal_dir: str, max_attempts: int):
+        self.max_batch = max_batch
+        self.interval = interval
+        self.durability = durability
+        self.journal_dir = Path(journal_dir)
+        self.max_attempts = max_attempts
+        self._entries = []  # new recipe ops
+        self._retry_recipes = []
+        self._retry_counters = []
+        self._waiters = {}  # seq -> future, durability "flush"
+        self._pending = {}  # recipe id -> recipe, until inserted
+        self._seq = 0
+        self._journal = None
+        self._journal_path = None
+        self._journal_lock = threading.Lock()
+        self._journal_inflight = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self.dead_letters = deque(maxlen=WRITE_BEHIND_DEAD_LETTER_LIMIT)
+        self.dead_lettered = 0
+        # seq -> journal entry and the steps that never completed, rewritten
+        # into the journal whenever it is truncated
+        self._dead_entries = {}
+        self._dead_steps = {}
+        self.flushes = 0
+        self.flush_errors = 0
+        self.flushed_recipes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": True,
+            "durability": self.durability,
+            "queue_depth": len(self._entries),
+            "retry_depth": len(self._retry_recipes) + len(self._retry_counters),
+            "dead_letters": self.dead_lettered,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "flushed_recipes": self.flushed_recipes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2)
+        }
+
+    def pending_recipe(self, recipe_id: str) -> Optional[dict]:
+        recipe = self._pending.get(recipe_id)
+        return {k: v for k, v in recipe.items() if k != "_id"} if recipe else None
+
+    async def start(self):
+        if self.durability == "journal":
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            self._open_journal()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and drain everything still buffered."""
+        # Not cancelled: a flush interrupted mid-write would lose its batch
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+        await self.flush()
+        if self._journal:
+            self._journal.close()
+            if not self._has_work() and not self._dead_entries:
+                os.remove(self._journal_path)
+
+    async def add(self, recipe: dict, stats_inc: dict):
+        self._seq += 1
+        op = {"seq": self._seq, "recipe": recipe, "stats_inc": stats_inc, "attempts": 0}
+        if self._journal:
+            line = json.dumps({"seq": op["seq"], "recipe": recipe, "stats_inc": stats_inc}, ensure_ascii=False)
+            # Counted until queued, so a truncation never drops a fresh line
+            self._journal_inflight += 1
+            try:
+                await asyncio.to_thread(self._append_journal, [line])
+                self._entries.append(op)
+            finally:
+                self._journal_inflight -= 1
+        else:
+            self._entries.append(op)
+        self._pending[recipe["id"]] = recipe
+        if len(self._entries) >= self.max_batch:
+            self._wakeup.set()
+        if self.durability == "flush":
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[op["seq"]] = waiter
+            await waiter
+
+    async def flush(self):
+        # Retries wait for their backoff; new entries always go out
+        retry_due = self._stopping or time.monotonic() >= self._retry_at
+        recipe_ops = self._entries
+        counter_ops = []
+        if retry_due:
+            recipe_ops = self._retry_recipes + recipe_ops
+            counter_ops = self._retry_counters
+            self._retry_recipes, self._retry_counters = [], []
+        self._entries = []
+        if not recipe_ops and not counter_ops:
+            return
+        start = time.perf_counter()
+        failures = 0
+        
+        if recipe_ops:
+            inserted, failed, transient = await _insert_recipe_ops(recipe_ops)
+            failures += len(failed)
+            for op in inserted:
+                self._pending.pop(op["recipe"]["id"], None)
+                self._resolve(op["seq"])
+            for op in failed:
+                if not transient:
+                    op["attempts"] += 1
+                if self.durability == "flush":
+                    # Not retried: the request fails and the user isn't charged
+                    self._pending.pop(op["recipe"]["id"], None)
+                    self._resolve(op["seq"], HTTPException(status_code=500, detail="Errore nel salvare la ricetta. Riprova."))
+                elif op["attempts"] >= self.max_attempts:
+                    # Still journaled, so it stays readable via pending_recipe
+                    self._dead_letter("recipes", op)
+                else:
+                    self._retry_recipes.append(op)
+            self.flushed_recipes += len(inserted)
+            await self._checkpoint("recipes", [op["seq"] for op in inserted])
+            counter_ops = counter_ops + _fold_counter_ops(inserted)
+        
+        for collection in ("users", "user_stats"):
+            ops = [op for op in counter_ops if op["collection"] == collection]
+            if not ops:
+                continue
+            applied, failed, transient = await _apply_counter_ops(collection, ops)
+            failures += len(failed)
+            for op in failed:
+                if not transient:
+                    op["attempts"] += 1
+                if op["attempts"] >= self.max_attempts:
+                    self._dead_letter(collection, op)
+                else:
+                    self._retry_counters.append(op)
+            await self._checkpoint(collection, [seq for op in applied for seq in op["seqs"]])
+        
+        if failures:
+            self.flush_errors += 1
+            self._retry_delay = min(max(self._retry_delay * 2, self.interval), WRITE_BEHIND_MAX_BACKOFF_SECONDS)
+            self._retry_at = time.monotonic() + self._retry_delay
+        elif retry_due:
+            self._retry_delay = 0.0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.total_flush_ms += elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        if self._journal:
+            await asyncio.to_thread(self._truncate_if_drained)
+
+    def _resolve(self, seq: int, error: Optional[Exception] = None):
+        waiter = self._waiters.pop(seq, None)
+        if waiter is None or waiter.done():
+            return
+        if error:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(None)
+
+    def _dead_letter(self, collection: str, op: dict):
+        self.dead_lettered += 1
+        record = {"collection": collection, "op": op, "at": datetime.now(timezone.utc).isoformat()}
+        self.dead_letters.append(record)
+        if self._journal:
+            # A dead recipe never got its counters either
+            steps = ("recipes", "users", "user_stats") if collection == "recipes" else (collection,)
+            for entry in op["entries"] if collection != "recipes" else [op]:
+                self._dead_entries[entry["seq"]] = {k: entry[k] for k in ("seq", "recipe", "stats_inc")}
+                self._dead_steps.setdefault(entry["seq"], set()).update(steps)
+        logger.error(f"Write-behind dead letter: {json.dumps(record, default=str, ensure_ascii=False)}")
+
+    def _has_work(self) -> bool:
+        return bool(self._entries or self._retry_recipes or self._retry_counters or self._journal_inflight)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}")
+
+    # ---- journal ----
+
+    def _open_journal(self):
+        # Locked under a name the orphan scan ignores, then renamed: a peer
+        # starting at the same time can never see it unlocked
+        name = f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        tmp_path = self.journal_dir / f".{name}.tmp"
+        self._journal = open(tmp_path, "a", encoding="utf-8")
+        fcntl.flock(self._journal, fcntl.LOCK_EX)
+        self._journal_path = self.journal_dir / name
+        os.rename(tmp_path, self._journal_path)
+
+    def _append_journal(self, lines: List[str]):
+        with self._journal_lock:
+            for line in lines:
+                self._journal.write(line + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    async def _checkpoint(self, collection: str, seqs: List[int]):
+        if self._journal and seqs:
+            await asyncio.to_thread(self._append_journal, [json.dumps({"done": collection, "seqs": seqs})])
+
+    def _truncate_if_drained(self):
+        with self._journal_lock:
+            if not self._has_work():
+                # Only the dead letters are left to replay
+                self._journal.truncate(0)
+                for seq, entry in self._dead_entries.items():
+                    self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    for step in ("recipes", "users", "user_stats"):
+                        if step not in self._dead_steps[seq]:
+                            self._journal.write(json.dumps({"done": step, "seqs": [seq]}) + "\n")
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+    async def adopt_orphan_journals(self):
+        """Take over journals left by processes that died before flushing.
+
+        Needs Mongo, so it runs from warm_up; on error the journal is left in
+        place and the exception propagates, so warm_up retries it."""
+        if not self._journal:
+            return
+        for path in sorted(self.journal_dir.glob("journal-*.jsonl")):
+            if path == self._journal_path:
+                continue
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue  # adopted by a peer meanwhile
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owned by a live worker
+                try:
+                    if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue  # a peer adopted and unlinked it before we locked
+                adopted = await self._adopt_journal(f)
+                # Unlinked while still locked, so no peer can adopt it twice
+                os.remove(path)
+                logger.info(f"Adopted {adopted} journaled writes from {path.name}")
+
+    async def _adopt_journal(self, f) -> int:
+        entries, done = {}, {"recipes": set(), "users": set(), "user_stats": set()}
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write at crash time
+            if "done" in record:
+                done.setdefault(record["done"], set()).update(record["seqs"])
+            else:
+                entries[record["seq"]] = record
+        
+        unfinished = [
+            e for seq, e in sorted(entries.items())
+            if not all(seq in done[kind] for kind in ("recipes", "users", "user_stats"))
+        ]
+        if not unfinished:
+            return 0
+        
+        not_inserted = [e for e in unfinished if e["seq"] not in done["recipes"]]
+        existing = set(await db.recipes.distinct("id", {"id": {"$in": [e["recipe"]["id"] for e in not_inserted]}}))
+        
+        lines, recipe_ops, inserted = [], [], []
+        for e in unfinished:
+            if e["seq"] not in done["recipes"] and e["recipe"]["id"] in existing:
+                # Inserted but not checkpointed: whether its counters ran is
+                # unknown, so they are not rebuilt (never counted twice)
+                continue
+            self._seq += 1
+            op = {"seq": self._seq, "recipe": e["recipe"], "stats_inc": e["stats_inc"], "attempts": 0}
+            lines.append(json.dumps({"seq": op["seq"], "recipe": op["recipe"], "stats_inc": op["stats_inc"]}, ensure_ascii=False))
+            if e["seq"] in done["recipes"]:
+                lines.append(json.dumps({"done": "recipes", "seqs": [op["seq"]]}))
+                # Only the counter writes that were never checkpointed
+                op["skip"] = {kind for kind in ("users", "user_stats") if e["seq"] in done[kind]}
+                for kind in op["skip"]:
+                    lines.append(json.dumps({"done": kind, "seqs": [op["seq"]]}))
+                inserted.append(op)
+            else:
+                recipe_ops.append(op)
+        
+        # Durable in our own journal before the orphan is unlinked
+        await asyncio.to_thread(self._append_journal, lines)
+        self._entries.extend(recipe_ops)
+        self._retry_counters.extend(_fold_counter_ops(inserted))
+        return len(recipe_ops) + len(inserted)
+
+def _fold_counter_ops(recipe_ops: list) -> list:
+    users, stats = {}, {}
+    for op in recipe_ops:
+        user_id = op["recipe"]["user_id"]
+        skip = op.get("skip", ())
+        # entries: what a dead letter writes back into the journal
+        if "users" not in skip:
+            folded = users.setdefault(user_id, {"collection": "users", "user_id": user_id, "inc": {}, "seqs": [], "entries": [], "attempts": 0})
+            folded["inc"]["recipes_generated_this_month"] = folded["inc"].get("recipes_generated_this_month", 0) + 1
+            folded["seqs"].append(op["seq"])
+            folded["entries"].append(op)
+        if "user_stats" not in skip:
+            folded = stats.setdefault(user_id, {"collection": "user_stats", "user_id": user_id, "inc": {}, "seqs": [], "entries": [], "attempts": 0})
+            for key, value in op["stats_inc"].items():
+                folded["inc"][key] = folded["inc"].get(key, 0) + value
+            folded["seqs"].append(op["seq"])
+            folded["entries"].append(op)
+    return list(users.values()) + list(stats.values())
+
+async def _insert_recipe_ops(ops: list) -> tuple:
+    """insert_many the recipes; returns (inserted, failed, transient). Failures
+    are transient (connection, timeout) unless Mongo rejected the documents."""
+    transient = False
+    try:
+        await db.recipes.insert_many([op["recipe"] for op in ops], ordered=False)
+        return ops, [], False
+    except BulkWriteError as e:
+        # A duplicate _id means an earlier attempt already inserted it
+        failed = {err["index"] for err in e.details["writeErrors"] if err["code"] != 11000}
+        if failed:
+            logger.error(f"Write-behind insert failed for {len(failed)}/{len(ops)} recipes: {e.details['writeErrors'][0].get('errmsg')}")
+    except Exception as e:
+        logger.error(f"Write-behind insert error ({len(ops)} recipes): {e}")
+        failed, transient = set(range(len(ops))), True
+    return [op for i, op in enumerate(ops) if i not in failed], [op for i, op in enumerate(ops) if i in failed], transient
+
+async def _apply_counter_ops(collection: str, ops: list) -> tuple:
+    """bulk_write the folded $inc ops; returns (applied, failed, transient)."""
+    transient = False
+    if collection == "users":
+        requests = [UpdateOne({"id": op["user_id"]}, {"$inc": op["inc"]}) for op in ops]
+    else:
+        now = datetime.now(timezone.utc).isoformat()
+        requests = [
+            UpdateOne({"user_id": op["user_id"]}, {"$inc": op["inc"], "$set": {"updated_at": now}}, upsert=True)
+            for op in ops
+        ]
+    try:
+        await db[collection].bulk_write(requests, ordered=False)
+        return ops, [], False
+    except BulkWriteError as e:
+        # Only the reported indexes failed; retrying the rest would repeat their $inc
+        failed = {err["index"] for err in e.details["writeErrors"]}
+        logger.error(f"Write-behind {collection} update failed for {len(failed)}/{len(ops)} users: {e.details['writeErrors'][0].get('errmsg') if failed else e}")
+    except Exception as e:
+        logger.error(f"Write-behind {collection} update error ({len(ops)} users): {e}")
+        failed, transient = set(range(len(ops))), True
+    return [op for i, op in enumerate(ops) if i not in failed], [op for i, op in enumerate(ops) if i in failed], transient
+
+# Created at startup when WRITE_BEHIND_ENABLED is set
+write_buffer: Optional[WriteBehindBuffer] = None
+
 # ==================== SAVED RECIPES ====================
 
 @api_router.post("/recipes/{recipe_id}/save")
 async def save_recipe(recipe_id: str, user: dict = Depends(get_current_user)):
     # Check if recipe exists
-    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0})
+    recipe = await find_recipe(recipe_id)
     if not recipe:
         raise HTTPException(status_code=404, detail="Ricetta non trovata")
     
@@ -376,33 +1311,310 @@ async def save_recipe(recipe_id: str, user: dict = Depends(get_current_user)):
     }
     
     await db.saved_recipes.insert_one(saved)
+    await record_saved_stats(user["id"], saved["category"], 1)
     return {"message": "Ricetta salvata!", "id": saved["id"]}
 
 @api_router.delete("/recipes/saved/{saved_id}")
 async def unsave_recipe(saved_id: str, user: dict = Depends(get_current_user)):
-    result = await db.saved_recipes.delete_one({"id": saved_id, "user_id": user["id"]})
-    if result.deleted_count == 0:
+    saved = await db.saved_recipes.find_one_and_delete(
+        {"id": saved_id, "user_id": user["id"]},
+        projection={"_id": 0, "category": 1}
+    )
+    if not saved:
         raise HTTPException(status_code=404, detail="Ricetta salvata non trovata")
+    await record_saved_stats(user["id"], saved["category"], -1)
     return {"message": "Ricetta rimossa dai preferiti"}
 
-@api_router.get("/recipes/saved", response_model=List[SavedRecipeResponse])
-async def get_saved_recipes(user: dict = Depends(get_current_user)):
-    saved = await db.saved_recipes.find({"user_id": user["id"]}, {"_id": 0}).sort("saved_at", -1).to_list(100)
-    return [SavedRecipeResponse(**s) for s in saved]
+def list_projection(compact: bool, include: Optional[str]) -> dict:
+    # Compact mode leaves the long text fields in Mongo; omitted fields are
+    # unset on the models and dropped from the response (exclude_unset)
+    projection = {"_id": 0}
+    if compact:
+        requested = {field.strip() for field in (include or "").split(",")}
+        for field in COMPACT_OMITTED_FIELDS:
+            if field not in requested:
+                projection[field] = 0
+    return projection
+
+@api_router.get("/recipes/saved", response_model=List[SavedRecipeListItem], response_model_exclude_unset=True)
+async def get_saved_recipes(compact: bool = False, include: Optional[str] = None, user: dict = Depends(get_current_user)):
+    projection = list_projection(compact, include)
+    saved = await db.saved_recipes.find({"user_id": user["id"]}, projection).sort("saved_at", -1).to_list(100)
+    return [SavedRecipeListItem(**s) for s in saved]
 
-@api_router.get("/recipes/history", response_model=List[RecipeResponse])
-async def get_recipe_history(user: dict = Depends(get_current_user)):
-    recipes = await db.recipes.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(50)
-    return [RecipeResponse(**r) for r in recipes]
+@api_router.get("/recipes/history", response_model=List[RecipeListItem], response_model_exclude_unset=True)
+async def get_recipe_history(compact: bool = False, include: Optional[str] = None, user: dict = Depends(get_current_user)):
+    projection = list_projection(compact, include)
+    recipes = await db.recipes.find({"user_id": user["id"]}, projection).sort("created_at", -1).to_list(50)
+    return [RecipeListItem(**r) for r in recipes]
 
 # ==================== SHARING ====================
 
+SHARED_HIDDEN_FIELDS = ("user_id", "input_signature", "input_ingredients", "shared")
+
 @api_router.get("/recipes/shared/{recipe_id}")
 async def get_shared_recipe(recipe_id: str):
-    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0, "user_id": 0})
+    recipe = await find_recipe(recipe_id)
     if not recipe:
         raise HTTPException(status_code=404, detail="Ricetta non trovata")
-    return recipe
+    if not recipe.get("shared"):
+        # Shared recipes are exempt from archival
+        await db.recipes.update_one({"id": recipe_id}, {"$set": {"shared": True}})
+    return {k: v for k, v in recipe.items() if k not in SHARED_HIDDEN_FIELDS}
+
+# ==================== RETENTION ====================
+
+# Fields kept uncompressed on archive entries, for lookups and stats rebuilds
+ARCHIVE_STUB_FIELDS = ("id", "user_id", "category", "input_ingredients", "created_at", "degraded")
+
+def _archive_file_path(name: str) -> Path:
+    return Path(RETENTION_ARCHIVE_DIR) / name
+
+def _write_archive_file(name: str, recipes: List[dict]) -> int:
+    path = _archive_file_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recipes).encode()
+    compressed = zstandard.ZstdCompressor(level=RETENTION_ZSTD_LEVEL).compress(payload)
+    path.write_bytes(compressed)
+    return len(compressed)
+
+def _read_archive_file(name: str, recipe_id: str) -> Optional[dict]:
+    with open(_archive_file_path(name), "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        for line in io.TextIOWrapper(reader, encoding="utf-8"):
+            recipe = json.loads(line)
+            if recipe["id"] == recipe_id:
+                return recipe
+    return None
+
+async def find_archived_recipe(recipe_id: str) -> Optional[dict]:
+    entry = await db.recipe_archive.find_one({"id": recipe_id}, {"_id": 0})
+    if not entry:
+        return None
+    if "data" in entry:
+        return json.loads(zlib.decompress(entry["data"]))
+    return await asyncio.to_thread(_read_archive_file, entry["file"], recipe_id)
+
+async def find_recipe(recipe_id: str) -> Optional[dict]:
+    """Look up a recipe in the live collection, the write buffer, then the archive tier."""
+    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0})
+    if recipe:
+        return recipe
+    if write_buffer:
+        # Generated moments ago and not flushed yet
+        recipe = write_buffer.pending_recipe(recipe_id)
+        if recipe:
+            return recipe
+    return await find_archived_recipe(recipe_id)
+
+async def _archive_batch(batch: List[dict], report: dict):
+    ids = [r["id"] for r in batch]
+    # Saved recipes stay live: save_recipe and shared links point at them
+    saved_ids = set(await db.saved_recipes.distinct("recipe_id", {"recipe_id": {"$in": ids}}))
+    batch = [r for r in batch if r["id"] not in saved_ids]
+    if not batch:
+        return
+    
+    now = datetime.now(timezone.utc)
+    stubs = [
+        {**{k: r[k] for k in ARCHIVE_STUB_FIELDS if k in r}, "archived_at": now.isoformat()}
+        for r in batch
+    ]
+    if RETENTION_TARGET == "file":
+        name = f"recipes-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.zst"
+        compressed_size = await asyncio.to_thread(_write_archive_file, name, batch)
+        for stub in stubs:
+            stub["file"] = name
+        archived_bytes = compressed_size + sum(len(bson.encode(s)) for s in stubs)
+    else:
+        for stub, recipe in zip(stubs, batch):
+            stub["data"] = zlib.compress(json.dumps(recipe, ensure_ascii=False).encode(), RETENTION_ZLIB_LEVEL)
+        archived_bytes = sum(len(bson.encode(s)) for s in stubs)
+    
+    # Archive first, then delete: a crash in between leaves the recipe live,
+    # and the next run finds its stub already archived (unique id)
+    try:
+        await db.recipe_archive.insert_many(stubs, ordered=False)
+    except BulkWriteError as e:
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]) or e.details.get("writeConcernErrors"):
+            raise
+    await db.recipes.delete_many({"id": {"$in": [r["id"] for r in batch]}})
+    
+    report["archived"] += len(batch)
+    report["live_bytes"] += sum(len(bson.encode(r)) for r in batch)
+    report["archived_bytes"] += archived_bytes
+
+async def archive_old_recipes() -> dict:
+    """Move old, unsaved and unshared recipes to the archive tier in batches.
+    Returns counts and the reclaimed (logical BSON) bytes."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)).isoformat()
+    report = {"archived": 0, "live_bytes": 0, "archived_bytes": 0}
+    
+    cursor = db.recipes.find(
+        {"created_at": {"$lt": cutoff}, "shared": {"$ne": True}},
+        {"_id": 0}
+    ).batch_size(RETENTION_BATCH_SIZE)
+    batch = []
+    async for recipe in cursor:
+        batch.append(recipe)
+        if len(batch) >= RETENTION_BATCH_SIZE:
+            await _archive_batch(batch, report)
+            batch = []
+    if batch:
+        await _archive_batch(batch, report)
+    
+    report["reclaimed_bytes"] = report["live_bytes"] - report["archived_bytes"]
+    return report
+
+# ==================== USER STATS ====================
+
+def stat_key(value: str) -> str:
+    # Mongo field names can't contain dots or start with '$'
+    return value.strip().lower().replace(".", " ").replace("$", "")
+
+def category_key(category: str) -> str:
+    # category is free text in the request; an empty key is rejected by Mongo
+    key = stat_key(category)
+    return key if key in CATEGORY_PROMPTS else "altro"
+
+def empty_user_stats(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "recipes_generated": 0,
+        "recipes_by_category": {},
+        "ingredients": {},
+        "saved_recipes": 0,
+        "saved_by_category": {}
+    }
+
+def recipe_stats_inc(category: str, ingredients: List[str]) -> dict:
+    inc = {"recipes_generated": 1, f"recipes_by_category.{category_key(category)}": 1}
+    for name in {stat_key(i) for i in ingredients if stat_key(i)}:
+        inc[f"ingredients.{name}"] = 1
+    return inc
+
+async def record_recipe_stats(user_id: str, category: str, ingredients: List[str]):
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$inc": recipe_stats_inc(category, ingredients), "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+
+async def record_saved_stats(user_id: str, category: str, delta: int):
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {
+            "$inc": {"saved_recipes": delta, f"saved_by_category.{category_key(category)}": delta},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        upsert=True
+    )
+
+async def compute_user_stats(user_id: str) -> dict:
+    """Rebuild a user's stats from the source collections (streamed, not loaded)."""
+    stats = empty_user_stats(user_id)
+    # Archived recipes still count: their stubs keep category and inputs
+    for collection in (db.recipes, db.recipe_archive):
+        async for recipe in collection.find(
+            {"user_id": user_id, "degraded": {"$ne": True}}, {"_id": 0, "category": 1, "input_ingredients": 1}
+        ):
+            category = category_key(recipe["category"])
+            stats["recipes_generated"] += 1
+            stats["recipes_by_category"][category] = stats["recipes_by_category"].get(category, 0) + 1
+            # Recipes generated before input tracking have no input_ingredients
+            for name in {stat_key(i) for i in recipe.get("input_ingredients", []) if stat_key(i)}:
+                stats["ingredients"][name] = stats["ingredients"].get(name, 0) + 1
+    async for saved in db.saved_recipes.find({"user_id": user_id}, {"_id": 0, "category": 1}):
+        category = category_key(saved["category"])
+        stats["saved_recipes"] += 1
+        stats["saved_by_category"][category] = stats["saved_by_category"].get(category, 0) + 1
+    return stats
+
+def _normalize_stats(stats: dict) -> dict:
+    # Unsaving leaves zero counters behind; they are equivalent to missing keys
+    return {
+        key: {k: v for k, v in value.items() if v} if isinstance(value, dict) else value
+        for key, value in stats.items()
+        if key not in ("_id", "updated_at")
+    }
+
+async def _user_recently_active(user_id: str, since: str) -> bool:
+    # A recent recipe may still have its $inc in flight (or in the write buffer)
+    if await db.recipes.find_one({"user_id": user_id, "created_at": {"$gte": since}}, {"_id": 1}):
+        return True
+    return await db.saved_recipes.find_one({"user_id": user_id, "saved_at": {"$gte": since}}, {"_id": 1}) is not None
+
+async def _repair_user_stats(user_id: str, stored: Optional[dict], expected: dict) -> bool:
+    """Rewrite a user's counters, unless they could be racing a live update."""
+    since = (datetime.now(timezone.utc) - timedelta(seconds=USER_STATS_REPAIR_QUIET_SECONDS)).isoformat()
+    if stored is not None and stored.get("updated_at", "") >= since:
+        return False
+    if await _user_recently_active(user_id, since):
+        return False
+    expected = {**expected, "updated_at": datetime.now(timezone.utc).isoformat()}
+    if stored is None:
+        try:
+            await db.user_stats.insert_one(expected)
+        except DuplicateKeyError:
+            return False  # an $inc upsert created it meanwhile
+        return True
+    # Compare-and-set: any $inc since the read bumps updated_at and voids the rewrite
+    result = await db.user_stats.replace_one(
+        {"user_id": user_id, "updated_at": stored.get("updated_at")},
+        expected
+    )
+    return result.modified_count == 1
+
+async def check_user_stats(repair: bool = False) -> dict:
+    """Compare stored counters against the source collections for every user.
+    With repair, drifted (or missing) documents of users idle for
+    USER_STATS_REPAIR_QUIET_SECONDS are rewritten with a compare-and-set."""
+    checked, drifted, repaired = 0, 0, 0
+    async for user in db.users.find({}, {"_id": 0, "id": 1}):
+        checked += 1
+        stored = await db.user_stats.find_one({"user_id": user["id"]}, {"_id": 0})
+        expected = await compute_user_stats(user["id"])
+        if stored is not None and _normalize_stats({**empty_user_stats(user["id"]), **stored}) == _normalize_stats(expected):
+            continue
+        drifted += 1
+        if repair and await _repair_user_stats(user["id"], stored, expected):
+            repaired += 1
+    if drifted:
+        logger.warning(f"User stats drift for {drifted}/{checked} users (repaired: {repaired})")
+    return {"checked": checked, "drifted": drifted, "repaired": repaired}
+
+async def backfill_user_stats() -> dict:
+    """Build user_stats for data that predates the counters. One worker at a
+    time runs a pass (under a lease); passes repeat every
+    USER_STATS_BACKFILL_INTERVAL_SECONDS until no drifted user is left."""
+    if await db.jobs.find_one({"_id": "user_stats_backfill", "completed_at": {"$exists": True}}):
+        return {"skipped": True, "completed": True}
+    if not await claim_job_lease("user_stats_backfill", USER_STATS_BACKFILL_INTERVAL_SECONDS):
+        return {"skipped": True, "completed": False}
+    result = await check_user_stats(repair=True)
+    if result["repaired"] < result["drifted"]:
+        # Users skipped as active get another pass once the lease expires
+        return {**result, "completed": False}
+    # Marked only once done, so a worker killed mid-run doesn't skip it for good
+    await db.jobs.update_one(
+        {"_id": "user_stats_backfill"},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat(), "result": result}}
+    )
+    return {**result, "completed": True}
+
+@api_router.get("/users/me/stats", response_model=UserStatsResponse)
+async def get_user_stats(user: dict = Depends(get_current_user)):
+    stored = await db.user_stats.find_one({"user_id": user["id"]}, {"_id": 0}) or {}
+    # Upserts only create the counters they touch
+    stats = _normalize_stats({**empty_user_stats(user["id"]), **stored})
+    favourites = sorted(stats["ingredients"].items(), key=lambda item: -item[1])[:USER_STATS_TOP_INGREDIENTS]
+    return UserStatsResponse(
+        recipes_generated=stats["recipes_generated"],
+        recipes_by_category=stats["recipes_by_category"],
+        favourite_ingredients=[IngredientCount(name=name, count=count) for name, count in favourites],
+        saved_recipes=stats["saved_recipes"],
+        saved_by_category=stats["saved_by_category"]
+    )
 
 # ==================== PAYMENTS ====================
 
@@ -524,15 +1736,165 @@ async def stripe_webhook(request: Request):
         logger.error(f"Webhook error: {e}")
         return {"received": True}
 
+# ==================== BACKGROUND JOBS ====================
+
+async def claim_daily_job(name: str) -> bool:
+    """Return True for exactly one caller (process or worker) per UTC day."""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    try:
+        result = await db.jobs.update_one(
+            {"_id": name, "last_run": {"$ne": today}},
+            {"$set": {"last_run": today}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Already claimed today: the filter missed and the upsert collided
+        return False
+    return result.modified_count == 1 or result.upserted_id is not None
+
+async def claim_job_lease(name: str, seconds: int) -> bool:
+    """Return True for one caller at a time until the lease expires (or the
+    job is marked completed)."""
+    now = datetime.now(timezone.utc)
+    try:
+        result = await db.jobs.update_one(
+            {
+                "_id": name,
+                "completed_at": {"$exists": False},
+                "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now.isoformat()}}]
+            },
+            {"$set": {"lease_until": (now + timedelta(seconds=seconds)).isoformat(), "lease_holder": os.getpid()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Held by another worker (or completed): the filter missed and the upsert collided
+        return False
+    return result.modified_count == 1 or result.upserted_id is not None
+
+def daily_jobs() -> list:
+    # Repairs are safe while live: quiet window plus compare-and-set on updated_at
+    jobs = [("check_user_stats", lambda: check_user_stats(repair=True))]
+    if RETENTION_DAYS > 0:
+        jobs.append(("archive_recipes", archive_old_recipes))
+    if PRECOMPUTE_LLM_BUDGET > 0:
+        jobs.append(("precompute_recipes", precompute_popular_recipes))
+    return jobs
+
+async def offpeak_scheduler():
+    while True:
+        hour = datetime.now(timezone.utc).hour
+        if OFFPEAK_START_HOUR <= hour < OFFPEAK_END_HOUR:
+            for name, job in daily_jobs():
+                if not await claim_daily_job(name):
+                    continue
+                try:
+                    result = await job()
+                    logger.info(f"Daily job {name}: {result}")
+                except Exception as e:
+                    logger.error(f"Daily job {name} error: {e}")
+        await asyncio.sleep(OFFPEAK_CHECK_INTERVAL_SECONDS)
+
+async def run_backfills():
+    while True:
+        try:
+            result = await backfill_user_stats()
+            if not result.get("skipped"):
+                logger.info(f"User stats backfill: {result}")
+            if result["completed"]:
+                return
+        except Exception as e:
+            logger.error(f"User stats backfill error: {e}")
+        await asyncio.sleep(OFFPEAK_CHECK_INTERVAL_SECONDS)
+
+# ==================== COMPRESSION ====================
+
+# Server preference order; br is only offered when the brotli package is installed
+COMPRESSION_ENCODINGS = [e for e in ("br", "zstd", "gzip") if e != "br" or brotli is not None]
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    # Highest client q-value wins; server order only breaks ties
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSION_ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+@app.middleware("http")
+async def compress_recipe_responses(request: Request, call_next):
+    response = await call_next(request)
+    if not request.url.path.startswith(COMPRESSED_PATH_PREFIXES) or "content-encoding" in response.headers:
+        return response
+    
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    headers["vary"] = "Accept-Encoding"
+    if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+        body = compress_body(body, encoding)
+        headers["content-encoding"] = encoding
+    return Response(content=body, status_code=response.status_code, headers=headers)
+
+# ==================== METRICS ====================
+
+@api_router.get("/metrics")
+async def metrics():
+    return {
+        "write_buffer": write_buffer.metrics() if write_buffer else {"enabled": False},
+        "llm_breaker": llm_breaker.metrics()
+    }
+
 # ==================== HEALTH CHECK ====================
 
 @api_router.get("/")
 async def root():
     return {"message": "Smart Cooking API", "status": "online"}
 
+async def mongo_reachable() -> bool:
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+        return True
+    except Exception:
+        return False
+
+@api_router.get("/health/live")
+async def liveness():
+    # No dependency checks: a Mongo outage must not get workers restarted
+    return {"status": "alive", "pid": os.getpid()}
+
+@api_router.get("/health/ready")
+async def readiness():
+    if app_state["draining"]:
+        return JSONResponse(status_code=503, content={"status": "draining"})
+    if not app_state["ready"]:
+        if app_state["warm_up_error"]:
+            return JSONResponse(status_code=503, content={"status": "degraded", "error": app_state["warm_up_error"]})
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if not await mongo_reachable():
+        return JSONResponse(status_code=503, content={"status": "degraded", "mongo": False})
+    return {"status": "healthy", "pid": os.getpid()}
+
 @api_router.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return await readiness()
 
 # Include router
 app.include_router(api_router)
@@ -543,8 +1905,110 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Recipe-Degraded"],
 )
 
+background_tasks = []
+
+async def create_indexes():
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.revoked_tokens.create_index("revoked_at")
+    await db.precomputed_recipes.create_index([("signature", 1), ("served_count", 1)])
+    await db.user_stats.create_index("user_id", unique=True)
+    await db.recipe_archive.create_index("id", unique=True)
+    await db.recipe_archive.create_index("user_id")
+    # Per-user history, stats rebuilds and the stats repair quiet-window check
+    await db.recipes.create_index([("user_id", 1), ("created_at", -1)])
+    await db.saved_recipes.create_index([("user_id", 1), ("saved_at", -1)])
+    # Archival: the daily cutoff scan and the saved-recipe check per batch
+    await db.recipes.create_index("created_at")
+    await db.saved_recipes.create_index([("recipe_id", 1), ("user_id", 1)])
+    # Degraded-mode lookups by category and input ingredient
+    await db.recipes.create_index([("category", 1), ("input_ingredients", 1), ("created_at", -1)])
+
+async def warm_up():
+    """Get the worker ready, retrying while Mongo is unreachable.
+
+    Runs in the background so the server is already listening: until it
+    succeeds /api/health/ready answers "starting", then "degraded" with the
+    last error, and the worker is kept out of rotation instead of crashing.
+    """
+    while True:
+        if app_state["draining"]:
+            return
+        try:
+            await create_indexes()
+            await load_revoked_tokens()
+            if write_buffer:
+                await write_buffer.adopt_orphan_journals()
+            await asyncio.gather(*[client.admin.command("ping") for _ in range(max(1, MONGO_MIN_POOL_SIZE))])
+            break
+        except Exception as e:
+            app_state["warm_up_error"] = str(e)
+            logger.warning(f"Worker {os.getpid()} warm-up failed, retrying in {WARM_UP_RETRY_SECONDS}s: {e}")
+            await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+    app_state["warm_up_error"] = None
+    app_state["ready"] = True
+    logger.info(f"Worker {os.getpid()} ready (Mongo pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+    background_tasks.append(asyncio.create_task(sync_revoked_tokens()))
+    background_tasks.append(asyncio.create_task(run_backfills()))
+    background_tasks.append(asyncio.create_task(offpeak_scheduler()))
+
+def install_drain_signal_handlers():
+    """Report "draining" as soon as SIGTERM/SIGINT arrives.
+
+    uvicorn registers its exit handlers on the loop before the startup hooks
+    run, and the shutdown hooks only run after the listener is closed. The
+    exit handler is wrapped: readiness drops first, and uvicorn's own handler
+    runs DRAIN_SIGNAL_DELAY_SECONDS later.
+    """
+    loop = asyncio.get_running_loop()
+    # Not public API; without uvicorn's handlers the signals are left alone
+    handlers = getattr(loop, "_signal_handlers", {})
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = handlers.get(sig)
+        if previous is None:
+            continue
+        
+        def on_signal(previous=previous):
+            if app_state["draining"]:
+                # Second signal: exit now
+                previous._run()
+                return
+            app_state["draining"] = True
+            logger.info(f"Worker {os.getpid()} draining")
+            loop.call_later(DRAIN_SIGNAL_DELAY_SECONDS, previous._run)
+        
+        loop.add_signal_handler(sig, on_signal)
+
+@app.on_event("startup")
+async def start_worker():
+    install_drain_signal_handlers()
+    await start_write_buffer()
+    background_tasks.append(asyncio.create_task(warm_up()))
+
+async def start_write_buffer():
+    global write_buffer
+    if WRITE_BEHIND_ENABLED:
+        write_buffer = WriteBehindBuffer(
+            max_batch=WRITE_BEHIND_MAX_BATCH,
+            interval=WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+            durability=WRITE_BEHIND_DURABILITY,
+            journal_dir=WRITE_BEHIND_JOURNAL_DIR,
+            max_attempts=WRITE_BEHIND_MAX_ATTEMPTS
+        )
+        await write_buffer.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app_state["draining"] = True
+    # The server has already finished in-flight requests; wait for LLM calls
+    # started by background jobs before cancelling them
+    deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+    while app_state["llm_inflight"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    for task in background_tasks:
+        task.cancel()
+    if write_buffer:
+        await write_buffer.stop()
     client.close()
@@ -185,6 +185,37 @@ class SmartCookingAPITester:
         
         return success
 
+    def test_compact_recipe_history(self):
+        """Test compact mode omits the long text fields"""
+        success, response = self.run_test(
+            "Get Compact Recipe History",
+            "GET",
+            "recipes/history?compact=true",
+            200
+        )
+        
+        if success and any('instructions' in r for r in response):
+            self.log("❌ Compact history still contains instructions")
+            self.tests_passed -= 1
+            return False
+        
+        return success
+
+    def test_user_stats(self):
+        """Test aggregated user statistics"""
+        success, response = self.run_test(
+            "Get User Stats",
+            "GET",
+            "users/me/stats",
+            200
+        )
+        
+        if success:
+            self.log(f"   Recipes generated: {response.get('recipes_generated', 0)}")
+            self.log(f"   Saved recipes: {response.get('saved_recipes', 0)}")
+        
+        return success
+
     def test_shared_recipe(self):
         """Test shared recipe endpoint"""
         if not self.recipe_id:
@@ -237,6 +268,26 @@ class SmartCookingAPITester:
         
         return success
 
+    def test_logout(self):
+        """Test logout revokes the current token"""
+        success, _ = self.run_test(
+            "Logout",
+            "POST",
+            "auth/logout",
+            200
+        )
+        
+        if success:
+            # The revoked token must no longer be accepted
+            success, _ = self.run_test(
+                "Revoked Token Rejected",
+                "GET",
+                "auth/me",
+                401
+            )
+        
+        return success
+
     def run_all_tests(self):
         """Run all API tests"""
         self.log("🚀 Starting Smart Cooking API Tests")
@@ -254,11 +305,16 @@ class SmartCookingAPITester:
                 self.test_save_recipe()
                 self.test_get_saved_recipes()
                 self.test_get_recipe_history()
+                self.test_compact_recipe_history()
+                self.test_user_stats()
                 self.test_shared_recipe()
                 self.test_unsave_recipe()
             
             # Payment functionality
             self.test_checkout_creation()
+            
+            # Logout last: it revokes the token used above
+            self.test_logout()
         
         # Print results
         self.log(f"\n📊 Test Results: {self.tests_passed}/{self.tests_run} passed")
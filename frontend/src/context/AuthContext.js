@@ -60,6 +60,10 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    // Revoke the token server-side; local logout must not wait on it
+    if (axios.defaults.headers.common['Authorization']) {
+      axios.post(`${API}/auth/logout`).catch(() => {});
+    }
     localStorage.removeItem('token');
     delete axios.defaults.headers.common['Authorization'];
     setToken(null);
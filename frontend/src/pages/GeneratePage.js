@@ -27,6 +27,7 @@ const GeneratePage = () => {
   const [recipe, setRecipe] = useState(null);
   const [error, setError] = useState('');
   const [saved, setSaved] = useState(false);
+  const [degraded, setDegraded] = useState(false);
 
   const addIngredient = () => {
     if (inputValue.trim() && !ingredients.includes(inputValue.trim().toLowerCase())) {
@@ -56,6 +57,7 @@ const GeneratePage = () => {
     setError('');
     setRecipe(null);
     setSaved(false);
+    setDegraded(false);
 
     try {
       const response = await axios.post(`${API}/recipes/generate`, {
@@ -64,6 +66,7 @@ const GeneratePage = () => {
         servings
       });
       setRecipe(response.data);
+      setDegraded(response.headers['x-recipe-degraded'] === 'true');
       await refreshUser();
     } catch (err) {
       if (err.response?.status === 403) {
@@ -289,6 +292,13 @@ const GeneratePage = () => {
           </Card>
         )}
 
+        {/* Degraded Mode Notice */}
+        {recipe && degraded && (
+          <p className="font-body text-sm text-muted-foreground text-center" data-testid="recipe-degraded-notice">
+            Il nostro chef AI è molto richiesto: ecco una ricetta simile con i tuoi ingredienti.
+          </p>
+        )}
+
         {/* Recipe Result */}
         {recipe && (
           <Card className="animate-fade-in overflow-hidden" data-testid="recipe-result">
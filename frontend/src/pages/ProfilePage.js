@@ -1,4 +1,6 @@
+import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/card';
 import { Button } from '../components/ui/button';
@@ -7,12 +9,28 @@ import { Progress } from '../components/ui/progress';
 import BottomNav from '../components/BottomNav';
 import { 
   User, Crown, ChefHat, LogOut, Settings, 
-  CreditCard, ArrowRight, Sparkles 
+  CreditCard, ArrowRight, Sparkles, BarChart3 
 } from 'lucide-react';
 
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
 const ProfilePage = () => {
   const { user, logout } = useAuth();
   const navigate = useNavigate();
+  const [stats, setStats] = useState(null);
+
+  useEffect(() => {
+    fetchStats();
+  }, []);
+
+  const fetchStats = async () => {
+    try {
+      const response = await axios.get(`${API}/users/me/stats`);
+      setStats(response.data);
+    } catch (err) {
+      console.error('Error fetching stats:', err);
+    }
+  };
 
   const handleLogout = () => {
     logout();
@@ -110,6 +128,42 @@ const ProfilePage = () => {
           </CardContent>
         </Card>
 
+        {/* Stats Card */}
+        {stats && (
+          <Card data-testid="profile-stats-card">
+            <CardHeader>
+              <CardTitle className="font-heading text-lg flex items-center gap-2">
+                <BarChart3 className="w-5 h-5 text-primary" />
+                Le Tue Statistiche
+              </CardTitle>
+            </CardHeader>
+            <CardContent className="space-y-4">
+              <div className="grid grid-cols-2 gap-4 text-center">
+                <div>
+                  <p className="font-heading text-2xl font-semibold">{stats.recipes_generated}</p>
+                  <p className="font-body text-sm text-muted-foreground">Ricette generate</p>
+                </div>
+                <div>
+                  <p className="font-heading text-2xl font-semibold">{stats.saved_recipes}</p>
+                  <p className="font-body text-sm text-muted-foreground">Ricette salvate</p>
+                </div>
+              </div>
+              {stats.favourite_ingredients.length > 0 && (
+                <div>
+                  <p className="font-body text-sm text-muted-foreground mb-2">Ingredienti preferiti</p>
+                  <div className="flex flex-wrap gap-2">
+                    {stats.favourite_ingredients.map((ingredient) => (
+                      <Badge key={ingredient.name} variant="secondary">
+                        {ingredient.name} · {ingredient.count}
+                      </Badge>
+                    ))}
+                  </div>
+                </div>
+              )}
+            </CardContent>
+          </Card>
+        )}
+
         {/* Subscription Card */}
         {user?.plan !== 'unlimited' && (
           <Card className="border-primary/50 bg-primary/5">
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads these at import time; the Motor client connects lazily,
+# so the unit tests never need a running Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "dishgen_test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
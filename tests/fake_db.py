@@ -0,0 +1,120 @@
+"""In-memory stand-in for the Motor collections used by the background jobs.
+
+Supports the query operators those jobs use ($lt, $gte, $ne, $in, $exists)
+and a unique "id" on insert, like the real indexes."""
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if op == "$lt" and not (value is not None and value < operand):
+                return False
+            if op == "$gte" and not (value is not None and value >= operand):
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$exists" and (key in doc) != operand:
+                return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        return {k: doc[k] for k in included if k in doc}
+    return {k: v for k, v in doc.items() if k not in projection}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def batch_size(self, size):
+        return self
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = [dict(d) for d in docs]
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([project(d, projection) for d in self.docs if matches(d, query or {})])
+
+    async def find_one(self, query=None, projection=None):
+        found = [d for d in self.docs if matches(d, query or {})]
+        return project(found[0], projection) if found else None
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def distinct(self, key, query=None):
+        return list({d[key] for d in self.docs if key in d and matches(d, query or {})})
+
+    async def insert_one(self, doc):
+        if "id" in doc and any(d.get("id") == doc["id"] for d in self.docs):
+            raise DuplicateKeyError("duplicate key")
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                await self.insert_one(doc)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+    async def delete_many(self, query):
+        self.docs = [d for d in self.docs if not matches(d, query)]
+
+    async def find_one_and_update(self, query, update, sort=None, projection=None):
+        found = [d for d in self.docs if matches(d, query)]
+        for key, direction in reversed(sort or []):
+            found.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        if not found:
+            return None
+        for key, amount in update.get("$inc", {}).items():
+            found[0][key] = found[0].get(key, 0) + amount
+        return project(found[0], projection)
+
+
+class FakeDB:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name):
+        return getattr(self, name)
@@ -0,0 +1,124 @@
+import server
+from server import CircuitBreaker
+
+
+def make_breaker(**overrides):
+    params = dict(window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=1.0,
+                  slow_call_rate=0.5, open_seconds=30, half_open_probes=1)
+    params.update(overrides)
+    return CircuitBreaker(**params)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        ticket = breaker.allow()
+        assert ticket is not None
+        breaker.record(ticket, False, 0.1)
+    assert breaker.state == "closed"
+
+
+def test_opens_on_failure_rate_and_rejects():
+    breaker = make_breaker()
+    for success in (True, False, True, False):
+        breaker.record(breaker.allow(), success, 0.1)
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+    assert breaker.metrics()["rejected_calls"] == 1
+
+
+def test_opens_on_slow_call_rate():
+    breaker = make_breaker()
+    for elapsed in (0.1, 2.0, 0.1, 2.0):
+        breaker.record(breaker.allow(), True, elapsed)
+    assert breaker.state == "open"
+
+
+def test_half_open_limits_probes(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    breaker = make_breaker(half_open_probes=2)
+    breaker._transition("open")
+    assert breaker.allow() is None
+
+    clock.now += 30
+    probe = breaker.allow()
+    assert probe is not None
+    assert breaker.state == "half_open"
+    assert breaker.allow() is not None
+    assert breaker.allow() is None
+
+    # An abandoned probe frees its slot without a verdict
+    breaker.release(probe)
+    assert breaker.state == "half_open"
+    assert breaker.allow() is not None
+
+
+def test_half_open_success_closes(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    breaker = make_breaker()
+    breaker._transition("open")
+    clock.now += 30
+    breaker.record(breaker.allow(), True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.metrics()["window_calls"] == 0
+
+
+def test_half_open_failure_or_slow_call_reopens(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    for success, elapsed in ((False, 0.1), (True, 2.0)):
+        breaker = make_breaker()
+        breaker._transition("open")
+        clock.now += 30
+        breaker.record(breaker.allow(), success, elapsed)
+        assert breaker.state == "open"
+        assert breaker.allow() is None
+
+
+def test_calls_from_before_opening_dont_decide_half_open(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    breaker = make_breaker(min_calls=1, failure_rate=1.0)
+    straggler = breaker.allow()
+    breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == "open"
+
+    clock.now += 30
+    probe = breaker.allow()
+    assert breaker.state == "half_open"
+    # Started while closed, finishes during half-open: ignored either way
+    breaker.record(straggler, True, 45.0)
+    breaker.release(straggler)
+    assert breaker.state == "half_open"
+    assert breaker.allow() is None
+
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == "closed"
+
+
+def test_stale_probe_ignored_after_reopening(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    breaker = make_breaker(half_open_probes=2)
+    breaker._transition("open")
+    clock.now += 30
+    first, second = breaker.allow(), breaker.allow()
+    breaker.record(first, False, 0.1)
+    assert breaker.state == "open"
+
+    clock.now += 30
+    probe = breaker.allow()
+    breaker.record(second, True, 0.1)
+    assert breaker.state == "half_open"
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == "closed"
@@ -0,0 +1,35 @@
+import server
+from server import negotiate_encoding
+
+
+def test_prefers_server_order(monkeypatch):
+    monkeypatch.setattr(server, "COMPRESSION_ENCODINGS", ["br", "zstd", "gzip"])
+    assert negotiate_encoding("gzip, deflate, br, zstd") == "br"
+    assert negotiate_encoding("gzip, zstd") == "zstd"
+    assert negotiate_encoding("gzip") == "gzip"
+
+
+def test_respects_quality_values(monkeypatch):
+    monkeypatch.setattr(server, "COMPRESSION_ENCODINGS", ["br", "zstd", "gzip"])
+    assert negotiate_encoding("br;q=0, gzip;q=0.5") == "gzip"
+    assert negotiate_encoding("br;q=0, *") == "zstd"
+    assert negotiate_encoding("gzip;q=bogus") is None
+
+
+def test_client_quality_beats_server_order(monkeypatch):
+    monkeypatch.setattr(server, "COMPRESSION_ENCODINGS", ["br", "zstd", "gzip"])
+    assert negotiate_encoding("br;q=0.1, gzip;q=1") == "gzip"
+    assert negotiate_encoding("br;q=0.5, zstd;q=0.8, gzip;q=0.8") == "zstd"
+    assert negotiate_encoding("gzip;q=0.9, *;q=0.2") == "gzip"
+
+
+def test_no_acceptable_encoding(monkeypatch):
+    monkeypatch.setattr(server, "COMPRESSION_ENCODINGS", ["br", "zstd", "gzip"])
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("*;q=0") is None
+
+
+def test_skips_br_without_brotli(monkeypatch):
+    monkeypatch.setattr(server, "COMPRESSION_ENCODINGS", ["zstd", "gzip"])
+    assert negotiate_encoding("br, gzip") == "gzip"
@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from tests.fake_db import FakeCursor, FakeDB
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+
+def variant(variant_id, signature, served_count):
+    return {"id": variant_id, "signature": signature, "recipe": {"title": variant_id},
+            "served_count": served_count, "generated_at": datetime.now(timezone.utc).isoformat()}
+
+
+def test_take_rotates_through_least_served(db):
+    db.precomputed_recipes.docs = [
+        variant("a", "primo|4|pasta", 2),
+        variant("b", "primo|4|pasta", 0),
+        variant("c", "primo|4|pasta", 1),
+        variant("other", "dolce|4|mele", 0),
+    ]
+
+    async def scenario():
+        return [(await server.take_precomputed_recipe("primo|4|pasta"))["title"] for _ in range(6)]
+
+    served = asyncio.run(scenario())
+    assert served[0] == "b"
+    # Least-served first evens the pool out
+    assert {d["id"]: d["served_count"] for d in db.precomputed_recipes.docs} == {"a": 3, "b": 3, "c": 3, "other": 0}
+    assert asyncio.run(server.take_precomputed_recipe("secondo|4|pollo")) is None
+
+
+def test_precompute_stops_at_llm_budget(db, monkeypatch):
+    monkeypatch.setattr(server, "PRECOMPUTE_LLM_BUDGET", 4)
+    monkeypatch.setattr(server, "PRECOMPUTE_VARIANTS", 3)
+    # Already has all its variants: costs no calls
+    db.precomputed_recipes.docs = [variant(f"full{i}", "primo|4|pasta", 0) for i in range(3)]
+    combos = [
+        {"_id": "primo|4|pasta", "ingredients": ["pasta"], "category": "primo", "servings": 4},
+        {"_id": "dolce|4|mele", "ingredients": ["mele"], "category": "dolce", "servings": 4},
+        {"_id": "secondo|2|pollo", "ingredients": ["pollo"], "category": "secondo", "servings": 2},
+    ]
+    db.recipes.aggregate = lambda pipeline: FakeCursor(list(combos))
+    calls = []
+
+    async def fake_generate(ingredients, category, servings):
+        calls.append(category)
+        return {"title": f"{category} {len(calls)}"}
+
+    monkeypatch.setattr(server, "generate_recipe_fields", fake_generate)
+    assert asyncio.run(server.precompute_popular_recipes()) == 4
+    assert calls == ["dolce", "dolce", "dolce", "secondo"]
+    assert asyncio.run(db.precomputed_recipes.count_documents({"signature": "secondo|2|pollo"})) == 1
+
+
+def test_precompute_stops_when_draining(db, monkeypatch):
+    monkeypatch.setattr(server, "PRECOMPUTE_LLM_BUDGET", 10)
+    monkeypatch.setitem(server.app_state, "draining", True)
+    db.recipes.aggregate = lambda pipeline: FakeCursor([
+        {"_id": "dolce|4|mele", "ingredients": ["mele"], "category": "dolce", "servings": 4}
+    ])
+    assert asyncio.run(server.precompute_popular_recipes()) == 0
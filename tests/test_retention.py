@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.fake_db import FakeDB
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
+def recipe(recipe_id, created_at, **extra):
+    return {"id": recipe_id, "user_id": "u1", "title": f"Ricetta {recipe_id}", "category": "primo",
+            "input_ingredients": ["pasta"], "created_at": created_at, **extra}
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    fake = FakeDB()
+    monkeypatch.setattr(server, "db", fake)
+    monkeypatch.setattr(server, "write_buffer", None)
+    monkeypatch.setattr(server, "RETENTION_DAYS", 90)
+    monkeypatch.setattr(server, "RETENTION_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    fake.recipes.docs = [
+        recipe("old", days_ago(200)),
+        recipe("old2", days_ago(120)),
+        recipe("saved", days_ago(200)),
+        recipe("shared", days_ago(200), shared=True),
+        recipe("recent", days_ago(10)),
+    ]
+    fake.saved_recipes.docs = [{"id": "s1", "user_id": "u2", "recipe_id": "saved"}]
+    return fake
+
+
+@pytest.mark.parametrize("target", ["mongo", "file"])
+def test_archives_only_old_unsaved_unshared(db, monkeypatch, target):
+    monkeypatch.setattr(server, "RETENTION_TARGET", target)
+    report = asyncio.run(server.archive_old_recipes())
+    assert report["archived"] == 2
+    assert {r["id"] for r in db.recipes.docs} == {"saved", "shared", "recent"}
+    assert {s["id"] for s in db.recipe_archive.docs} == {"old", "old2"}
+    stub = db.recipe_archive.docs[0]
+    assert "title" not in stub and stub["category"] == "primo"
+
+
+def test_rerun_tolerates_duplicate_stubs(db, monkeypatch):
+    monkeypatch.setattr(server, "RETENTION_TARGET", "mongo")
+    # A crash between the archive insert and the delete left "old" in both places
+    db.recipe_archive.docs.append({"id": "old", "user_id": "u1", "data": b"stale"})
+    report = asyncio.run(server.archive_old_recipes())
+    assert report["archived"] == 2
+    assert {r["id"] for r in db.recipes.docs} == {"saved", "shared", "recent"}
+    assert sorted(s["id"] for s in db.recipe_archive.docs) == ["old", "old2"]
+
+
+@pytest.mark.parametrize("target", ["mongo", "file"])
+def test_find_recipe_falls_back_to_archive(db, monkeypatch, target):
+    monkeypatch.setattr(server, "RETENTION_TARGET", target)
+
+    async def scenario():
+        await server.archive_old_recipes()
+        return await server.find_recipe("old"), await server.find_recipe("recent"), await server.find_recipe("missing")
+
+    archived, live, missing = asyncio.run(scenario())
+    assert archived["title"] == "Ricetta old"
+    assert archived["created_at"] == db.recipe_archive.docs[0]["created_at"]
+    assert live["id"] == "recent"
+    assert missing is None
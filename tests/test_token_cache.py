@@ -0,0 +1,60 @@
+import time
+
+import jwt
+import pytest
+
+import server
+from server import TokenCache
+
+
+def test_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", ("u1", 1, 1))
+    cache.put("b", ("u2", 1, 1))
+    assert cache.get("a") == ("u1", 1, 1)
+    cache.put("c", ("u3", 1, 1))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_put_refreshes_existing_entry():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", ("u1", 1, 1))
+    cache.put("b", ("u2", 1, 1))
+    cache.put("a", ("u1", 2, 2))
+    cache.put("c", ("u3", 1, 1))
+    assert cache.get("a") == ("u1", 2, 2)
+    assert cache.get("b") is None
+
+
+def test_discard():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", ("u1", 1, 1))
+    cache.discard("a")
+    cache.discard("missing")
+    assert cache.get("a") is None
+
+
+def legacy_token(secret):
+    # Issued before key rotation: no kid header
+    payload = {"user_id": "u1", "iat": time.time(), "exp": time.time() + 3600}
+    return jwt.encode(payload, secret, algorithm=server.JWT_ALGORITHM)
+
+
+def test_kidless_token_uses_legacy_key(monkeypatch):
+    monkeypatch.setattr(server, "JWT_KEYS", {"default": "old-secret-0123456789abcdef0123456789", "k2": "new-secret-0123456789abcdef0123456789"})
+    monkeypatch.setattr(server, "JWT_LEGACY_KID", "default")
+    monkeypatch.setattr(server, "token_cache", TokenCache(maxsize=10))
+    assert server.decode_token(legacy_token("old-secret-0123456789abcdef0123456789"))[0] == "u1"
+    with pytest.raises(jwt.InvalidTokenError):
+        server.decode_token(legacy_token("smart_cooking_secret"))
+
+
+def test_kidless_token_rejected_once_legacy_key_retired(monkeypatch):
+    monkeypatch.setattr(server, "JWT_KEYS", {"k2": "new-secret-0123456789abcdef0123456789"})
+    monkeypatch.setattr(server, "JWT_LEGACY_KID", "default")
+    monkeypatch.setattr(server, "token_cache", TokenCache(maxsize=10))
+    for secret in ("old-secret-0123456789abcdef0123456789", server.JWT_SECRET):
+        with pytest.raises(jwt.InvalidTokenError):
+            server.decode_token(legacy_token(secret))
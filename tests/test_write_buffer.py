@@ -0,0 +1,262 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+import server
+from server import WriteBehindBuffer
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.updates = []
+        self.bad_ids = set()
+        self.down = 0
+
+    async def insert_many(self, docs, ordered=True):
+        if self.down:
+            self.down -= 1
+            raise ConnectionError("down")
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["id"] in self.bad_ids:
+                errors.append({"index": index, "code": 2, "errmsg": "bad document"})
+            elif any(d["id"] == doc["id"] for d in self.docs):
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.docs.append(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.down:
+            self.down -= 1
+            raise ConnectionError("down")
+        self.updates.extend(requests)
+
+    async def distinct(self, key, query):
+        return [d[key] for d in self.docs if d[key] in query[key]["$in"]]
+
+
+class FakeDB:
+    def __init__(self):
+        self.recipes = FakeCollection()
+        self.users = FakeCollection()
+        self.user_stats = FakeCollection()
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+
+def recipe(recipe_id, user_id="u1"):
+    return {"id": recipe_id, "user_id": user_id}
+
+
+def generated(collection):
+    return sum(op._doc["$inc"]["recipes_generated_this_month"] for op in collection.updates)
+
+
+def test_flush_mode_fails_only_the_bad_entry(db, tmp_path):
+    async def scenario():
+        buffer = WriteBehindBuffer(4, 0.01, "flush", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        db.recipes.bad_ids = {"r2"}
+        results = await asyncio.gather(
+            *[buffer.add(recipe(f"r{i}", f"u{i % 2}"), {"recipes_generated": 1}) for i in range(6)],
+            return_exceptions=True
+        )
+        await buffer.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert [isinstance(r, HTTPException) for r in results] == [False, False, True, False, False, False]
+    assert len(db.recipes.docs) == 5
+    # The failed request is not charged
+    assert generated(db.users) == 5
+
+
+def retry_now(buffer):
+    # Skip the backoff between retries
+    buffer._retry_at = 0
+
+
+def test_journal_mode_retries_then_dead_letters(db, tmp_path):
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        db.recipes.bad_ids = {"r1"}
+        for i in range(3):
+            await buffer.add(recipe(f"r{i}"), {"recipes_generated": 1})
+        await buffer.flush()
+        # Retries don't hold back new entries
+        retry_now(buffer)
+        await buffer.add(recipe("r3"), {"recipes_generated": 1})
+        await buffer.flush()
+        assert {d["id"] for d in db.recipes.docs} == {"r0", "r2", "r3"}
+        retry_now(buffer)
+        await buffer.flush()
+        metrics = buffer.metrics()
+        await buffer.stop()
+        return buffer, metrics
+
+    buffer, metrics = asyncio.run(scenario())
+    assert metrics["dead_letters"] == 1
+    assert metrics["retry_depth"] == 0
+    assert buffer.dead_letters[0]["op"]["recipe"]["id"] == "r1"
+    # Acknowledged to the user: still readable and still in the journal
+    assert buffer.pending_recipe("r1") is not None
+    assert generated(db.users) == 3
+    assert len(list(tmp_path.iterdir())) == 1
+
+    async def next_worker():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        await buffer.adopt_orphan_journals()
+        await buffer.flush()
+        await buffer.stop()
+
+    db.recipes.bad_ids = set()
+    asyncio.run(next_worker())
+    assert {d["id"] for d in db.recipes.docs} == {"r0", "r1", "r2", "r3"}
+    assert generated(db.users) == 4
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_dead_counters_survive_journal_truncation(db, tmp_path):
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=1)
+        await buffer.start()
+        db.users.bulk_write = reject_all
+        await buffer.add(recipe("r0"), {"recipes_generated": 1})
+        await buffer.flush()
+        # Drained: truncated down to the dead letter
+        await buffer.add(recipe("r1", "u2"), {"recipes_generated": 1})
+        del db.users.bulk_write
+        await buffer.flush()
+        await buffer.stop()
+
+    async def reject_all(requests, ordered=True):
+        raise BulkWriteError({"writeErrors": [{"index": i, "code": 121, "errmsg": "invalid"} for i in range(len(requests))]})
+
+    asyncio.run(scenario())
+    assert generated(db.users) == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    async def next_worker():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        await buffer.adopt_orphan_journals()
+        await buffer.flush()
+        await buffer.stop()
+
+    asyncio.run(next_worker())
+    # Only the dead users counter is replayed; the recipe and stats were done
+    assert [d["id"] for d in db.recipes.docs] == ["r0", "r1"]
+    assert generated(db.users) == 2
+    assert sum(op._doc["$inc"]["recipes_generated"] for op in db.user_stats.updates) == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_outage_backs_off_without_using_attempts(db, tmp_path):
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=2)
+        await buffer.start()
+        db.recipes.down = 9
+        await buffer.add(recipe("r0"), {"recipes_generated": 1})
+        await buffer.flush()
+        first_delay = buffer._retry_delay
+        # Not due yet: the retry waits out its backoff
+        await buffer.flush()
+        assert db.recipes.down == 8
+        for _ in range(8):
+            retry_now(buffer)
+            await buffer.flush()
+        assert buffer._retry_delay > first_delay
+        assert buffer.metrics()["dead_letters"] == 0
+        retry_now(buffer)
+        await buffer.flush()
+        assert buffer._retry_delay == 0
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert [d["id"] for d in db.recipes.docs] == ["r0"]
+    assert generated(db.users) == 1
+
+
+def test_duplicate_key_counts_as_inserted(db, tmp_path):
+    db.recipes.docs.append(recipe("r0"))
+
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        await buffer.add(recipe("r0"), {"recipes_generated": 1})
+        await buffer.flush()
+        metrics = buffer.metrics()
+        await buffer.stop()
+        return metrics
+
+    metrics = asyncio.run(scenario())
+    assert metrics["retry_depth"] == 0
+    assert generated(db.users) == 1
+
+
+def test_adopts_orphan_journal_without_double_counting(db, tmp_path):
+    db.recipes.docs.append(recipe("inserted"))
+    db.recipes.docs.append(recipe("checkpointed"))
+    lines = [
+        {"seq": 1, "recipe": recipe("missing"), "stats_inc": {"recipes_generated": 1}},
+        # Inserted before the crash but never checkpointed: counters unknown
+        {"seq": 2, "recipe": recipe("inserted"), "stats_inc": {"recipes_generated": 1}},
+        # Inserted and users counter applied; user_stats still pending
+        {"seq": 3, "recipe": recipe("checkpointed"), "stats_inc": {"recipes_generated": 1}},
+        {"done": "recipes", "seqs": [3]},
+        {"done": "users", "seqs": [3]},
+    ]
+    orphan = tmp_path / "journal-1-dead.jsonl"
+    orphan.write_text("\n".join(json.dumps(line) for line in lines) + "\n{\"seq\": 4, \"rec")
+
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        await buffer.adopt_orphan_journals()
+        await buffer.flush()
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert [d["id"] for d in db.recipes.docs] == ["inserted", "checkpointed", "missing"]
+    assert generated(db.users) == 1
+    assert sum(op._doc["$inc"]["recipes_generated"] for op in db.user_stats.updates) == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_adoption_is_left_for_a_retry(db, tmp_path):
+    orphan = tmp_path / "journal-1-dead.jsonl"
+    orphan.write_text(json.dumps({"seq": 1, "recipe": recipe("missing"), "stats_inc": {}}) + "\n")
+
+    async def scenario():
+        buffer = WriteBehindBuffer(100, 0.01, "journal", str(tmp_path), max_attempts=3)
+        await buffer.start()
+        db.recipes.distinct = unreachable
+        with pytest.raises(ConnectionError):
+            await buffer.adopt_orphan_journals()
+        assert orphan.exists()
+        del db.recipes.distinct
+        await buffer.adopt_orphan_journals()
+        await buffer.stop()
+
+    async def unreachable(key, query):
+        raise ConnectionError("down")
+
+    asyncio.run(scenario())
+    assert [d["id"] for d in db.recipes.docs] == ["missing"]
+    assert list(tmp_path.iterdir()) == []